@@ -1,20 +1,34 @@
 from fastapi import Depends, FastAPI, HTTPException, Request
-from pydantic import BaseModel
-from supabase import create_client, Client
+from pydantic import BaseModel, field_validator
+from supabase import create_client, Client, ClientOptions
+from postgrest.exceptions import APIError
 import os
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-import requests
+from datetime import datetime, timezone
+import httpx
 import csv
-from csv import DictWriter
-import json
-import io
-from fastapi.responses import Response
+import codecs
+import orjson
+import ijson
+import itertools
+import zipfile
+from fastapi.responses import Response, ORJSONResponse, StreamingResponse
 from fastapi import File, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.datastructures import Headers
 import jwt
 import hashlib
+import hmac
 import secrets
 import base64
+import time
+import random
+import threading
+import asyncio
+import queue
+import anyio.to_thread
+from cachetools import TTLCache
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 
@@ -25,64 +39,393 @@ SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 JWT_KEY = os.getenv('JWT_KEY')
 JWT_ALGO = 'HS256'
 JWT_EXPIRE = 1800
-
-db: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-app = FastAPI(title="CRM")
+PASSWORD_ITERATIONS = int(os.getenv('PASSWORD_ITERATIONS', '310000'))
+THREADPOOL_SIZE = int(os.getenv('THREADPOOL_SIZE', '100'))
+EXPORT_TIMEOUT = 60
+EXPORT_CHUNK_SIZE = 65536
+EXPORT_PAGE_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
+CUSTOMER_COLUMNS = ("id", "name", "email", "phone", "company", "assigned_to", "created_at", "updated_at")
+DEAL_COLUMNS = ("id", "title", "amt", "status", "stage", "customer_id", "assigned_to", "created_at", "updated_at")
+NOTE_COLUMNS = ("id", "customer_id", "content", "type", "created_at", "updated_at")
+USER_FIELDS = "id, name, email, role, created_at, updated_at"
+CURRENT_USER_FIELDS = "id, name, email, role"
+AUDIT_BATCH_SIZE = 100
+AUDIT_FLUSH_INTERVAL = 0.2
+AI_POOL_SIZE = 20
+AI_POOL_REFRESH = 300
+MOTIVATION_PROMPT = "generate a motivational sales quote or advice in one sentence.... make sure to keep it short, inspiring, and sales-focused."
+FUN_FACT_PROMPT = "generate a fun fact about sales."
+AI_MODEL = "openai/gpt-oss-120b"
+GEN_EMAIL_PROMPT = """
+Write a professional {type} email for:
+Customer: {name} at {company}
+Email: {email}
+Active Deals: {deals_count} worth ${deals_value}
+
+Make it:
+- Professional but friendly
+- Personalized
+- Under 150 words
+
+Include subject line."""
+OBJECTION_PROMPT = """
+help handle this sales objection:
+objection: "{objection}"
+context: {context}
+
+provide:
+1. 3 different response approaches
+2. questions to ask back
+3. evidence/proof points to use
+4. how to redirect conversation
+5. when to concede vs push back
+be practical and conversational."""
+MEETING_PREP_PROMPT = """
+Create a meeting prep brief for:
+Customer: {name} ({company})
+Active Deals: {deals_count} worth ${deals_value}
+Recent History: {notes_count} recent interactions
+
+Provide:
+1. Key talking points
+2. Questions to ask
+3. Potential objections & responses
+4. Goals for this meeting
+5. Follow-up actions
+
+Keep it concise and actionable."""
+ETAG_PATHS = ("/customers", "/deals", "/notes", "/users", "/analytics", "/audit-logs")
+ETAG_CACHE_CONTROL = "private, no-cache"
+FK_VIOLATION = "23503"
+FK_ERRORS = {
+    "customers_assigned_to_fkey": "Assigned user not found",
+    "deals_assigned_to_fkey": "Assigned user not found",
+    "deals_customer_id_fkey": "Customer not found",
+    "notes_customer_id_fkey": "Customer not found",
+}
+
+supabase_http = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_connections=THREADPOOL_SIZE, max_keepalive_connections=50)
+)
+db: Client = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(
+    postgrest_client_timeout=10,
+    httpx_client=supabase_http
+))
+
+token_cache = TTLCache(maxsize=10000, ttl=JWT_EXPIRE)
+token_cache_lock = threading.Lock()
+user_cache = TTLCache(maxsize=5000, ttl=60)
+user_cache_lock = threading.Lock()
+audit_queue = queue.Queue(maxsize=10000)
+motivation_pool = []
+fun_fact_pool = []
+ai_refresh_tasks = {}
+ai_miss_tasks = {}
+
+app = FastAPI(title="CRM", default_response_class=ORJSONResponse)
 security = HTTPBearer()
 
-def create_jwt_token(data: dict) -> str:
+class ETagMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or not scope["path"].startswith(ETAG_PATHS):
+            await self.app(scope, receive, send)
+            return
+        start = None
+        body = bytearray()
+
+        async def buffered_send(message):
+            nonlocal start
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                start = message
+                return
+            if start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            body.extend(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+            cache_headers = [(b"etag", etag.encode()), (b"cache-control", ETAG_CACHE_CONTROL.encode())]
+            if etag in (tag.strip().removeprefix("W/") for tag in Headers(scope=scope).get("if-none-match", "").split(",")):
+                await send({"type": "http.response.start", "status": 304, "headers": cache_headers})
+                await send({"type": "http.response.body", "body": b""})
+                return
+            headers = [(k, v) for k, v in start["headers"] if k not in (b"etag", b"cache-control", b"content-length")]
+            headers += cache_headers + [(b"content-length", str(len(body)).encode())]
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": bytes(body)})
+
+        await self.app(scope, receive, buffered_send)
+
+app.add_middleware(ETagMiddleware)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5, exclude_content_types=("text/event-stream", "application/zip"))
+
+@app.on_event("startup")
+async def configure_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+def create_jwt_token(data: dict, expires_in: int = JWT_EXPIRE) -> str:
     payload = {
         **data,
-        "exp": datetime.utcnow() + timedelta(seconds=JWT_EXPIRE)
+        "exp": int(time.time()) + expires_in
     }
     token = jwt.encode(payload, JWT_KEY, algorithm=JWT_ALGO)
     return token
 
 def custom_hash_password(password: str, salt: str = None) -> tuple:
-    if salt is None:
-        salt = secrets.token_hex(32)
+    salt_bytes = secrets.token_bytes(32) if salt is None else bytes.fromhex(salt)
+    hashed = hashlib.pbkdf2_hmac("sha256", password.encode(), salt_bytes, PASSWORD_ITERATIONS).hex()
+    return f"pbkdf2_sha256${PASSWORD_ITERATIONS}${hashed}", salt_bytes.hex()
+
+def needs_rehash(hashed: str) -> bool:
+    return not hashed.startswith(f"pbkdf2_sha256${PASSWORD_ITERATIONS}$")
+
+def legacy_hash_password(password: str, salt: str) -> str:
     salted = password + salt
     for _ in range(6969):
         salted = hashlib.sha256(salted.encode()).hexdigest()
-
-    return salted, salt
+    return salted
 
 def log_audit_event(
     user_id: str = None,
     action: str = None,
     type: str = None,
     resource_id: str = None,
-    details: str = None,
+    details: dict = None,
     ip: str = None,
     agent: str = None
 ):
+    audit_data = {
+        "user_id": user_id,
+        "action": action,
+        "type": type,
+        "resource_id": resource_id,
+        "details": details,
+        "ip": ip,
+        "agent": agent,
+        "timestamp": time.time()
+    }
     try:
-        audit_data = {
-            "user_id": user_id,
-            "action": action,
-            "type": type,
-            "resource_id": resource_id,
-            "details": details,
-            "ip": ip,
-            "agent": agent,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        
-        db.table("audit_logs").insert(audit_data).execute()
+        audit_queue.put_nowait(audit_data)
+    except queue.Full:
+        print("Audit logging failed: queue is full")
+
+timestamp_prefix = (0, "")
+
+def iso_timestamp(ts: float = None) -> str:
+    global timestamp_prefix
+    if ts is None:
+        ts = time.time()
+    second = int(ts)
+    cached = timestamp_prefix
+    if cached[0] != second:
+        cached = (second, datetime.fromtimestamp(second, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"))
+        timestamp_prefix = cached
+    return f"{cached[1]}.{int((ts - second) * 1000):03d}+00:00"
+
+def write_audit_events(batch: list):
+    for event in batch:
+        event["timestamp"] = iso_timestamp(event["timestamp"])
+    try:
+        db.table("audit_logs").insert(batch).execute()
+        return
+    except APIError as e:
+        if len(batch) == 1:
+            print(f"Audit logging failed: {str(e)}")
+            return
     except Exception as e:
-        print(f"Audit logging failed: {str(e)}")
+        print(f"Audit logging failed, dropped {len(batch)} events: {str(e)}")
+        return
+    for event in batch:
+        try:
+            db.table("audit_logs").insert(event).execute()
+        except Exception as e:
+            print(f"Audit logging failed: {str(e)}")
+
+def audit_worker():
+    while True:
+        event = audit_queue.get()
+        if event is None:
+            return
+        batch = [event]
+        deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+        while len(batch) < AUDIT_BATCH_SIZE:
+            try:
+                event = audit_queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if event is None:
+                write_audit_events(batch)
+                return
+            batch.append(event)
+        write_audit_events(batch)
+
+@app.on_event("startup")
+def start_audit_worker():
+    app.state.audit_thread = threading.Thread(target=audit_worker, daemon=True)
+    app.state.audit_thread.start()
+
+@app.on_event("startup")
+async def open_http_client():
+    app.state.http = httpx.AsyncClient(
+        base_url="https://ai.hackclub.com",
+        timeout=30,
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=AI_POOL_SIZE)
+    )
+
+@app.on_event("shutdown")
+async def close_http_client():
+    for task in itertools.chain(ai_refresh_tasks.values(), ai_miss_tasks.values()):
+        task.cancel()
+    await app.state.http.aclose()
+
+@app.on_event("shutdown")
+def stop_audit_worker():
+    audit_queue.put(None)
+    app.state.audit_thread.join(timeout=5)
+
+@app.on_event("shutdown")
+def close_supabase_client():
+    supabase_http.close()
+
+def handle_fk_violation(e: APIError, not_found: tuple = ()):
+    if e.code == FK_VIOLATION:
+        for constraint, detail in FK_ERRORS.items():
+            if constraint in (e.message or ""):
+                raise HTTPException(status_code=404 if constraint in not_found else 400, detail=detail)
+    raise e
 
 def get_client_info(request: Request):
     ip = request.client.host if request.client else None
     agent = request.headers.get("user-agent")
     return ip, agent
 
-def verify(password, hashed, salt):
-    test_hash, _ = custom_hash_password(password, salt)
-    return test_hash == hashed
+def stream_table_csv(table: str, columns: tuple):
+    offset = 0
+    while True:
+        r = supabase_http.get(
+            f"{SUPABASE_URL}/rest/v1/{table}",
+            params={"select": ",".join(columns), "order": "id", "offset": offset, "limit": EXPORT_PAGE_SIZE},
+            headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}", "Accept": "text/csv"},
+            timeout=EXPORT_TIMEOUT
+        )
+        r.raise_for_status()
+        page = r.headers.get("content-range", "*").split("/")[0]
+        if page == "*":
+            break
+        end = int(page.split("-")[1])
+        if offset:
+            yield b"\n" + r.content.partition(b"\n")[2]
+        else:
+            yield r.content
+        offset = end + 1
+    if offset:
+        yield b"\n"
+    else:
+        yield ",".join(columns).encode() + b"\n"
+
+class ZipStream:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+def stream_csv_zip(tables: dict):
+    output = ZipStream()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+        for table, columns in tables.items():
+            with archive.open(f"{table}.csv", "w") as entry:
+                for chunk in stream_table_csv(table, columns):
+                    entry.write(chunk)
+                    yield output.take()
+            yield output.take()
+    yield output.take()
+
+def iter_table(table: str):
+    offset = 0
+    while True:
+        rows = db.table(table).select("*").order("id").range(offset, offset + EXPORT_PAGE_SIZE - 1).execute().data
+        if not rows:
+            return
+        yield from rows
+        offset += len(rows)
+
+def peek_rows(rows):
+    first = next(rows, None)
+    if first is None:
+        return None
+    return itertools.chain([first], rows)
+
+def stream_json_array(rows, pretty: bool = False):
+    option = orjson.OPT_INDENT_2 if pretty else 0
+    separator = b",\n" if pretty else b","
+    chunk = bytearray(b"[")
+    for i, row in enumerate(rows):
+        if i:
+            chunk += separator
+        chunk += orjson.dumps(row, option=option)
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield bytes(chunk)
+            chunk.clear()
+    chunk += b"]"
+    yield bytes(chunk)
+
+def stream_json_object(sections: dict, pretty: bool = False):
+    yield b"{"
+    for i, (key, rows) in enumerate(sections.items()):
+        yield (b"," if i else b"") + orjson.dumps(key) + b":"
+        yield from stream_json_array(rows, pretty)
+    yield b"}"
+
+def insert_in_batches(table: str, rows) -> int:
+    inserted = 0
+    batch = []
+    try:
+        for row in rows:
+            batch.append(row)
+            if len(batch) == IMPORT_BATCH_SIZE:
+                db.table(table).insert(batch).execute()
+                inserted += len(batch)
+                batch = []
+        if batch:
+            db.table(table).insert(batch).execute()
+            inserted += len(batch)
+    except Exception:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Error processing file: batch {inserted // IMPORT_BATCH_SIZE + 1} failed, {inserted} rows from earlier batches were already imported"
+        )
+    return inserted
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def verify(password, hashed, salt):
+    if hashed.startswith("pbkdf2_sha256$"):
+        _, iterations, digest = hashed.split("$")
+        test_hash = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations)).hex()
+        return hmac.compare_digest(test_hash, digest)
+    return hmac.compare_digest(legacy_hash_password(password, salt), hashed)
+
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    key = hashlib.sha256(credentials.credentials.encode()).digest()
+    with token_cache_lock:
+        payload = token_cache.get(key)
+    if payload and payload["exp"] > time.time():
+        return payload["sub"]
     try:
         payload = jwt.decode(credentials.credentials, JWT_KEY, algorithms=[JWT_ALGO])
         user_id: str = payload.get("sub")
@@ -92,6 +435,9 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
                 detail="Could not validate credentials",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        if "exp" in payload:
+            with token_cache_lock:
+                token_cache[key] = payload
         return user_id
     except jwt.PyJWTError:
         raise HTTPException(
@@ -100,17 +446,35 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-def get_current_user(user_id: str = Depends(verify_token)):
-    user = db.table("users").select("*").eq("id", user_id).execute()
+async def get_current_user(user_id: str = Depends(verify_token)):
+    with user_cache_lock:
+        cached = user_cache.get(user_id)
+    if cached:
+        return cached
+    user = await run_in_threadpool(db.table("users").select(CURRENT_USER_FIELDS).eq("id", user_id).execute)
     if not user.data:
         raise HTTPException(
             status_code=401,
             detail="User not found"
         )
+    with user_cache_lock:
+        user_cache[user_id] = user.data[0]
     return user.data[0]
 
+def get_user_secret(user_id: str):
+    user = db.table("users").select("password_hash, password_salt").eq("id", user_id).execute()
+    if not user.data:
+        raise HTTPException(
+            status_code=401,
+            detail="User not found"
+        )
+    return user.data[0]
+
+def invalidate_user(user_id: str):
+    with user_cache_lock:
+        user_cache.pop(user_id, None)
+
 class Customer(BaseModel):
-    id: str = None
     name: str
     email: str = None
     phone: str = None
@@ -118,7 +482,6 @@ class Customer(BaseModel):
     assigned_to: str = None
 
 class Deal(BaseModel):
-    id: str = None
     title: str
     amt: float
     status: str = "open"
@@ -126,21 +489,24 @@ class Deal(BaseModel):
     assigned_to: str = None
 
 class Note(BaseModel):
-    id: str = None
     customer_id: str
     content: str
     type: str = "general"
-    created_at: str = None
 
 class Status(BaseModel):
     status: str
 
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
 class User(BaseModel):
     id: str = None
     name: str
     email: str
     role: str = "sales_rep"
 
+    _normalize_email = field_validator("email")(normalize_email)
+
 class Assignment(BaseModel):
     assigned_to: str
 
@@ -150,10 +516,14 @@ class UserCreate(BaseModel):
     password: str
     role: str = "sales_rep"
 
+    _normalize_email = field_validator("email")(normalize_email)
+
 class UserLogin(BaseModel):
     email: str
     password: str
 
+    _normalize_email = field_validator("email")(normalize_email)
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -189,25 +559,21 @@ def list_customers(request: Request, assigned_to: str = None, current_user: dict
         user_id=current_user["id"],
         action="READ",
         type="customer",
-        details=json.dumps({"filter": {"assigned_to": assigned_to}, "count": len(result)}),
+        details={"filter": {"assigned_to": assigned_to}, "count": len(result)},
         ip=ip,
         agent=agent
     )
     
-    return result
+    return ORJSONResponse(result)
 
 @app.post("/customers")
 def create_customer(customer: Customer, request: Request, current_user: dict = Depends(get_current_user)):
     ip, agent = get_client_info(request)
-    data = customer.dict(exclude_unset=True)
-    original_data = data.copy()
-    data.pop("id", None)
-    if data.get('assigned_to'):
-        user = db.table("users").select("*").eq("id", data['assigned_to']).execute()
-        if not user.data:
-            raise HTTPException(status_code=400, detail="Assigned user not found")
-    
-    result = (db.table('customers').insert(data).execute()).data
+    data = customer.model_dump(exclude_unset=True)
+    try:
+        result = (db.table('customers').insert(data).execute()).data
+    except APIError as e:
+        handle_fk_violation(e)
     
     if result:
         log_audit_event(
@@ -215,7 +581,7 @@ def create_customer(customer: Customer, request: Request, current_user: dict = D
             action="CREATE",
             type="customer",
             resource_id=result[0].get("id"),
-            details=json.dumps({"created_data": original_data}),
+            details={"created_data": data},
             ip=ip,
             agent=agent
         )
@@ -232,24 +598,21 @@ def update_customer(id: str, customer: Customer, request: Request, current_user:
     if (current_user["role"] == "sales_rep" and 
         existing_customer.data[0].get("assigned_to") != current_user["id"]):
         raise HTTPException(status_code=403, detail="Not authorized to update this customer")
-    data = customer.dict(exclude_unset=True)
-    update_data = data.copy()
-    data.pop("id", None)
-    if data.get('assigned_to'):
-        user = db.table("users").select("*").eq("id", data['assigned_to']).execute()
-        if not user.data:
-            raise HTTPException(status_code=400, detail="Assigned user not found")
-    resp = db.table("customers").update(data).eq("id", id).execute()
+    data = customer.model_dump(exclude_unset=True)
+    try:
+        resp = db.table("customers").update(data).eq("id", id).execute()
+    except APIError as e:
+        handle_fk_violation(e)
     
     log_audit_event(
         user_id=current_user["id"],
         action="UPDATE",
         type="customer",
         resource_id=id,
-        details=json.dumps({
+        details={
             "old_data": existing_customer.data[0],
-            "new_data": update_data
-        }),
+            "new_data": data
+        },
         ip=ip,
         agent=agent
     )
@@ -258,7 +621,7 @@ def update_customer(id: str, customer: Customer, request: Request, current_user:
 
 @app.delete("/customers/{id}")
 def delete_customer(id: str, request: Request, current_user: dict = Depends(get_current_user)):
-    client_info = get_client_info(request)
+    ip, agent = get_client_info(request)
     
     existing_customer = db.table("customers").select("*").eq("id", id).execute()
     if not existing_customer.data:
@@ -276,7 +639,8 @@ def delete_customer(id: str, request: Request, current_user: dict = Depends(get_
         type="customer",
         resource_id=id,
         details={"deleted_data": existing_customer.data[0]},
-        **client_info
+        ip=ip,
+        agent=agent
     )
     
     return {"ok": True}
@@ -298,46 +662,38 @@ def list_deals(assigned_to: str = None, current_user: dict = Depends(get_current
         query = query.eq('assigned_to', assigned_to)
     elif current_user["role"] == "sales_rep":
         query = query.eq('assigned_to', current_user["id"])
-    return query.execute().data
+    return ORJSONResponse(query.execute().data)
 
 
 
 @app.post("/deals")
 def create_deal(deal: Deal, current_user: dict = Depends(get_current_user)):
-    data = deal.dict(exclude_unset=True)
-    data.pop("id", None)
+    data = deal.model_dump(exclude_unset=True)
     if not data.get('assigned_to') and current_user["role"] == "sales_rep":
         data['assigned_to'] = current_user["id"]
-    if data.get('assigned_to'):
-        user = db.table("users").select("*").eq("id", data['assigned_to']).execute()
-        if not user.data:
-            raise HTTPException(status_code=400, detail="Assigned user not found")
-    if data.get('customer_id'):
-        customer = db.table("customers").select("*").eq("id", data['customer_id']).execute()
-        if not customer.data:
-            raise HTTPException(status_code=400, detail="Customer not found")
-    return (db.table('deals').insert(data).execute()).data
+    try:
+        return (db.table('deals').insert(data).execute()).data
+    except APIError as e:
+        handle_fk_violation(e)
 
 @app.put("/deals/{deal_id}")
 def update_deal(deal_id: str, deal: Deal, current_user: dict = Depends(get_current_user)):
-    existing_deal = db.table("deals").select("*").eq("id", deal_id).execute()
+    existing_deal = db.table("deals").select("assigned_to").eq("id", deal_id).execute()
     if not existing_deal.data:
         raise HTTPException(status_code=404, detail="Deal not found")
     if (current_user["role"] == "sales_rep" and 
         existing_deal.data[0].get("assigned_to") != current_user["id"]):
         raise HTTPException(status_code=403, detail="Not authorized to update this deal")
-    data = deal.dict(exclude_unset=True)
-    data.pop("id", None)
-    if data.get('assigned_to'):
-        user = db.table("users").select("*").eq("id", data['assigned_to']).execute()
-        if not user.data:
-            raise HTTPException(status_code=400, detail="Assigned user not found")
-    resp = db.table("deals").update(data).eq("id", deal_id).execute()
+    data = deal.model_dump(exclude_unset=True)
+    try:
+        resp = db.table("deals").update(data).eq("id", deal_id).execute()
+    except APIError as e:
+        handle_fk_violation(e)
     return resp.data
 
 @app.delete("/deals/{deal_id}")
 def delete_deal(deal_id: str, current_user: dict = Depends(get_current_user)):
-    existing_deal = db.table("deals").select("*").eq("id", deal_id).execute()
+    existing_deal = db.table("deals").select("assigned_to").eq("id", deal_id).execute()
     if not existing_deal.data:
         raise HTTPException(status_code=404, detail="Deal not found")
     if (current_user["role"] == "sales_rep" and 
@@ -348,6 +704,11 @@ def delete_deal(deal_id: str, current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="Deal not found")
     return {"ok": True}
 
+@app.get("/deals/pipeline")
+def get_deals_pipeline(assigned_to: str = None):
+    pipeline = db.rpc("deals_pipeline", {"p_user": assigned_to}).execute().data
+    return ORJSONResponse(pipeline)
+
 @app.get("/deals/{deal_id}")
 def get_deal(deal_id: str, current_user: dict = Depends(get_current_user)):
     deal = db.table("deals").select("*, users!deals_assigned_to_fkey(id, name, email), customers!deals_customer_id_fkey(id, name, company)").eq("id", deal_id).execute()
@@ -358,76 +719,55 @@ def get_deal(deal_id: str, current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Not authorized to view this deal")
     return deal.data[0]
 
-@app.post("/users")
-def create_user(name: str, email: str, password: str):
-    return (db.table("users").insert({"name": name, "email": email, "password": password}).execute()).data
-
 @app.post("/customers/{id}/deals")
 def create_customer_deal(id: str, deal: Deal):
-    customer = db.table("customers").select("*").eq("id", id).execute()
-    if not customer.data:
-        raise HTTPException(status_code=404, detail="Customer not found")
-    data = deal.dict(exclude_unset=True)
-    data.pop("id", None)
+    data = deal.model_dump(exclude_unset=True)
     data["customer_id"] = id
-    if not data.get('assigned_to') and customer.data[0].get('assigned_to'):
-        data['assigned_to'] = customer.data[0]['assigned_to']
-    return (db.table("deals").insert(data).execute()).data
+    if not data.get('assigned_to'):
+        customer = db.table("customers").select("assigned_to").eq("id", id).execute()
+        if not customer.data:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        if customer.data[0].get('assigned_to'):
+            data['assigned_to'] = customer.data[0]['assigned_to']
+    try:
+        return (db.table("deals").insert(data).execute()).data
+    except APIError as e:
+        handle_fk_violation(e, not_found=("deals_customer_id_fkey",))
 
 @app.get("/customers/{id}/deals")
 def list_customer_deals(id: str):
-    customer = db.table("customers").select("*").eq("id", id).execute()
+    customer = db.table("customers").select("id, deals!deals_customer_id_fkey(*, users!deals_assigned_to_fkey(id, name, email))").eq("id", id).execute()
     if not customer.data:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return (db.table("deals").select("*, users!deals_assigned_to_fkey(id, name, email)").eq("customer_id", id).execute()).data
+    return ORJSONResponse(customer.data[0]["deals"])
 
 @app.put("/deals/{deal_id}/status")
 def update_deal_status(deal_id: str, status: Status):
-    data = status.dict(exclude_unset=True)
+    data = status.model_dump(exclude_unset=True)
     resp = db.table("deals").update(data).eq("id", deal_id).execute()
     if not resp.data:
         raise HTTPException(status_code=404, detail="Deal not found")
     return resp.data
 
-@app.get("/deals/pipeline")
-def get_deals_pipeline(assigned_to: str = None):
-    query = db.table('deals').select('*, users!deals_assigned_to_fkey(id, name), customers!deals_customer_id_fkey(id, name, company)')
-    if assigned_to:
-        query = query.eq('assigned_to', assigned_to)
-    deals = query.execute().data
-    pipeline = {
-        "open": [],
-        "in_progress": [],
-        "won": [],
-        "lost": []
-    }
-    for deal in deals:
-        stage = deal.get("stage", "open")
-        if stage in pipeline:
-            pipeline[stage].append(deal)
-    return pipeline
-
 @app.post("/customers/{id}/notes")
 def create_customer_note(id: str, note: Note):
-    customer = db.table("customers").select("*").eq("id", id).execute()
-    if not customer.data:
-        raise HTTPException(status_code=404, detail="Customer not found")
-    data = note.dict(exclude_unset=True)
-    data.pop("id", None)
+    data = note.model_dump(exclude_unset=True)
     data["customer_id"] = id
-    data["created_at"] = str(datetime.now())
-    return (db.table("notes").insert(data).execute()).data
+    try:
+        return (db.table("notes").insert(data).execute()).data
+    except APIError as e:
+        handle_fk_violation(e, not_found=("notes_customer_id_fkey",))
 
 @app.get("/customers/{id}/notes")
 def list_customer_notes(id: str):
-    customer = db.table("customers").select("*").eq("id", id).execute()
+    customer = db.table("customers").select("id, notes(*)").eq("id", id).execute()
     if not customer.data:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return (db.table("notes").select("*").eq("customer_id", id).execute()).data
+    return ORJSONResponse(customer.data[0]["notes"])
 
 @app.get("/notes")
 def list_notes():
-    return (db.table("notes").select("*").execute()).data
+    return ORJSONResponse((db.table("notes").select("*").execute()).data)
 
 @app.delete("/notes/{note_id}")
 def delete_note(note_id: str):
@@ -438,130 +778,114 @@ def delete_note(note_id: str):
 
 @app.get("/analytics/deals-summary")
 def get_deals_summary(assigned_to: str = None):
-    query = db.table('deals').select('*')
-    if assigned_to:
-        query = query.eq('assigned_to', assigned_to)
-    
-    deals = query.execute().data
-    total = len(deals)
-    win = [d for d in deals if d.get('status') == 'won' or d.get('stage') == 'won']
-    lose = [d for d in deals if d.get('status') == 'lost' or d.get('stage') == 'lost']
-    open = [d for d in deals if d.get('stage') in ['open', 'in_progress']]
-    total_revenue = sum(d.get('amt', 0) for d in win)
-    potential_revenue = sum(d.get('amt', 0) for d in open)
-    rate = (len(win) / total * 100) if total > 0 else 0
-    return {
+    summary = db.rpc("deals_summary", {"p_user": assigned_to}).execute().data[0]
+    total = summary["total_deals"]
+    won = summary["won_deals"]
+    total_revenue = summary["total_revenue"]
+    rate = (won / total * 100) if total > 0 else 0
+    return ORJSONResponse({
         "total_deals": total,
-        "won_deals": len(win),
-        "lost_deals": len(lose),
-        "open_deals": len(open),
+        "won_deals": won,
+        "lost_deals": summary["lost_deals"],
+        "open_deals": summary["open_deals"],
         "win_rate_percentage": round(rate, 2),
         "total_revenue": total_revenue,
-        "potential_revenue": potential_revenue,
-        "average_deal_size": round(total_revenue / len(win), 2) if win else 0,
+        "potential_revenue": summary["potential_revenue"],
+        "average_deal_size": round(total_revenue / won, 2) if won else 0,
         "filtered_by_user": assigned_to is not None
-    }
+    })
 
 @app.get("/analytics/customer-value/{id}")
 def get_customer_value(id: str):
-    customer = db.table("customers").select("*").eq("id", id).execute()
-    if not customer.data:
+    value = db.rpc("customer_value", {"p_customer": id}).execute()
+    if not value.data:
         raise HTTPException(status_code=404, detail="Customer not found")
-    deals = (db.table("deals").select("*").eq("customer_id", id).execute()).data
-    total = sum(d.get('amt', 0) for d in deals if d.get('status') == 'win')
-    potential_value = sum(d.get('amt', 0) for d in deals if d.get('status') in ['open', 'in_progress'])
-    tdeals = len(deals)
-    wdeals = len([d for d in deals if d.get('status') == 'win'])
+    value = value.data[0]
+    total = value["total_value"]
+    wdeals = value["won_deals"]
 
-    return {
+    return ORJSONResponse({
         "customer_id": id,
-        "customer_name": customer.data[0].get('name'),
+        "customer_name": value["customer_name"],
         "total_value": total,
-        "potential_value": potential_value,
-        "total_deals": tdeals,
+        "potential_value": value["potential_value"],
+        "total_deals": value["total_deals"],
         "won_deals": wdeals,
         "average_deal_size": round(total / wdeals, 2) if wdeals > 0 else 0
-    }
+    })
 
 @app.get("/analytics/top-customers")
 def get_top_customers(assigned_to: str = None):
-    customerq = db.table('customers').select('*')
-    deal_query = db.table('deals').select('*')
-    if assigned_to:
-        customerq = customerq.eq('assigned_to', assigned_to)
-        deal_query = deal_query.eq('assigned_to', assigned_to)
-    customers = customerq.execute().data
-    deals = deal_query.execute().data
+    rows = db.rpc("top_customers", {"p_user": assigned_to, "p_limit": 10}).execute().data
     leaderboard = []
-    for customer in customers:
-        customer_deals = [d for d in deals if d.get('customer_id') == customer['id']]
-        won_deals = [d for d in customer_deals if d.get('status') == 'won' or d.get('stage') == 'won']
-        total = sum(d.get('amt', 0) for d in won_deals)
-        if total > 0:
-            leaderboard.append({
-                "customer_id": customer['id'],
-                "customer_name": customer.get('name'),
-                "company": customer.get('company'),
-                "email": customer.get('email'),
-                "total_revenue": total,
-                "deals_count": len(won_deals),
-                "average_deal_size": round(total / len(won_deals), 2) if won_deals else 0,
-                "assigned_to": customer.get('assigned_to')
-            })
-    leaderboard.sort(key=lambda x: x['total_revenue'], reverse=True)
-    return {
-        "top_customers": leaderboard[:10],
-        "total_customers_with_revenue": len(leaderboard),
+    for row in rows:
+        leaderboard.append({
+            "customer_id": row['customer_id'],
+            "customer_name": row['customer_name'],
+            "company": row['company'],
+            "email": row['email'],
+            "total_revenue": row['total_revenue'],
+            "deals_count": row['deals_count'],
+            "average_deal_size": round(row['total_revenue'] / row['deals_count'], 2),
+            "assigned_to": row['assigned_to']
+        })
+    return ORJSONResponse({
+        "top_customers": leaderboard,
+        "total_customers_with_revenue": rows[0]['customers_with_revenue'] if rows else 0,
         "filtered_by_user": assigned_to is not None
-    }
+    })
 
-@app.get("/motivation")
-def get_motivation():
-    r = requests.post("https://ai.hackclub.com/chat/completions", headers={
-        "Content-Type": "application/json"
-    },
-    json={
-        "model": "openai/gpt-oss-120b",
-        "messages": [
-            {
-                "role": "user",
-                "content": "generate a motivational sales quote or advice in one sentence.... make sure to keep it short, inspiring, and sales-focused."
-            }
-        ]
+async def ask_ai(prompt: str) -> str:
+    r = await app.state.http.post("/chat/completions", json={
+        "model": AI_MODEL,
+        "messages": [{"role": "user", "content": prompt}]
     })
     r = r.json()
-    return {"quote": r['choices'][0]['message']['content']}
+    return r['choices'][0]['message']['content']
+
+async def refresh_ai_pool(pool: list, prompt: str):
+    while True:
+        results = await asyncio.gather(*(ask_ai(prompt) for _ in range(AI_POOL_SIZE)), return_exceptions=True)
+        fresh = [r for r in results if isinstance(r, str)]
+        if fresh:
+            pool[:] = fresh
+        if len(fresh) < len(results):
+            errors = [r for r in results if not isinstance(r, str)]
+            print(f"AI pool refresh failed for {len(errors)} responses: {str(errors[0])}")
+        await asyncio.sleep(AI_POOL_REFRESH)
+
+async def pooled_ai_response(pool: list, prompt: str) -> str:
+    if pool:
+        return random.choice(pool)
+    task = ai_miss_tasks.get(prompt)
+    if task is None or task.done():
+        task = ai_miss_tasks[prompt] = asyncio.create_task(ask_ai(prompt))
+    response = await asyncio.shield(task)
+    if not pool:
+        pool.append(response)
+    return response
+
+@app.on_event("startup")
+async def start_ai_pools():
+    ai_refresh_tasks[MOTIVATION_PROMPT] = asyncio.create_task(refresh_ai_pool(motivation_pool, MOTIVATION_PROMPT))
+    ai_refresh_tasks[FUN_FACT_PROMPT] = asyncio.create_task(refresh_ai_pool(fun_fact_pool, FUN_FACT_PROMPT))
+
+@app.get("/motivation")
+async def get_motivation():
+    return {"quote": await pooled_ai_response(motivation_pool, MOTIVATION_PROMPT)}
 
 @app.get("/fun-fact")
-def get_fun_fact():
-    r = requests.post("https://ai.hackclub.com/chat/completions", headers={
-        "Content-Type": "application/json"
-    },
-    json={
-        "model": "openai/gpt-oss-120b",
-        "messages": [
-            {
-                "role": "user",
-                "content": "generate a fun fact about sales."
-            }
-        ]
-    })
-    r = r.json()
-    return {"fun_fact": r['choices'][0]['message']['content']}
+async def get_fun_fact():
+    return {"fun_fact": await pooled_ai_response(fun_fact_pool, FUN_FACT_PROMPT)}
 
 @app.get("/export/customers")
-def export_customers(format: str = "json"):
-    customers = (db.table("customers").select("*").execute()).data
-    if not customers:
-        return {"error": "No customers found"}
+def export_customers(format: str = "json", pretty: bool = False):
     if format == "csv":
-        output = io.StringIO()
-        writer = DictWriter(output, fieldnames=customers[0].keys())
-        writer.writeheader()
-        writer.writerows(customers)
-        return Response(content=output.getvalue(), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=customers.csv"})
-    else:
-        return Response(content=json.dumps(customers, indent=2), media_type="application/json", headers={"Content-Disposition": "attachment; filename=customers.json"})
+        return StreamingResponse(stream_table_csv("customers", CUSTOMER_COLUMNS), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=customers.csv"})
+    customers = peek_rows(iter_table("customers"))
+    if customers is None:
+        return {"error": "No customers found"}
+    return StreamingResponse(stream_json_array(customers, pretty), media_type="application/json", headers={"Content-Disposition": "attachment; filename=customers.json"})
 
 @app.post("/import/customers")
 async def import_customers(file: UploadFile = File(...)):
@@ -569,43 +893,33 @@ async def import_customers(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="No file uploaded")
     ext = file.filename.split('.')[-1].lower()
     try:
-        content = await file.read()
         if ext == "csv":
-            content = content.decode("utf-8")
-            reader = csv.DictReader(io.StringIO(content))
-            customers = []
-            for row in reader:
-                customers.append({
-                    "name": row.get("name"),
-                    "email": row.get("email"),
-                    "company": row.get("company"),
-                    "phone": row.get("phone"),
-                })
-            customers = [c for c in customers if c.get('name')]
-            db.table("customers").insert(customers).execute()
-            return {"message": "Customers imported successfully"}
+            reader = csv.DictReader(codecs.iterdecode(file.file, "utf-8"))
+            customers = ({
+                "name": row.get("name"),
+                "email": row.get("email"),
+                "company": row.get("company"),
+                "phone": row.get("phone"),
+            } for row in reader if row.get("name"))
+            imported = await run_in_threadpool(insert_in_batches, "customers", customers)
+            return {"message": "Customers imported successfully", "imported": imported}
         elif ext == "json":
-            content = content.decode("utf-8")
-            customers = json.loads(content)
-            customers = [c for c in customers if c.get('name')]
-            db.table("customers").insert(customers).execute()
-            return {"message": "Customers imported successfully"}
+            customers = (c for c in ijson.items(file.file, "item", use_float=True) if c.get('name'))
+            imported = await run_in_threadpool(insert_in_batches, "customers", customers)
+            return {"message": "Customers imported successfully", "imported": imported}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail="Error processing file")
 
 @app.get("/export/deals")
-def export_deals(format: str = "json"):
-    deals = (db.table("deals").select("*").execute()).data
-    if not deals:
-        return {"error": "No deals found"}
+def export_deals(format: str = "json", pretty: bool = False):
     if format == "csv":
-        output = io.StringIO()
-        writer = DictWriter(output, fieldnames=deals[0].keys())
-        writer.writeheader()
-        writer.writerows(deals)
-        return Response(content=output.getvalue(), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=deals.csv"})
-    else:
-        return Response(content=json.dumps(deals, indent=2), media_type="application/json", headers={"Content-Disposition": "attachment; filename=deals.json"})
+        return StreamingResponse(stream_table_csv("deals", DEAL_COLUMNS), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=deals.csv"})
+    deals = peek_rows(iter_table("deals"))
+    if deals is None:
+        return {"error": "No deals found"}
+    return StreamingResponse(stream_json_array(deals, pretty), media_type="application/json", headers={"Content-Disposition": "attachment; filename=deals.json"})
 
 @app.post("/import/deals")
 async def import_deals(file: UploadFile = File(...)):
@@ -613,216 +927,187 @@ async def import_deals(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="No file uploaded")
     ext = file.filename.split('.')[-1].lower()
     try:
-        content = await file.read()
         if ext == "csv":
-            content = content.decode("utf-8")
-            reader = csv.DictReader(io.StringIO(content))
-            deals = []
-            for row in reader:
-                deals.append({
-                    "name": row.get("name"),
-                    "value": row.get("value"),
-                    "stage": row.get("stage"),
-                    "owner": row.get("owner"),
-                })
-            deals = [d for d in deals if d.get('name')]
-            db.table("deals").insert(deals).execute()
-            return {"message": "Deals imported successfully"}
+            reader = csv.DictReader(codecs.iterdecode(file.file, "utf-8"))
+            deals = ({
+                "name": row.get("name"),
+                "value": row.get("value"),
+                "stage": row.get("stage"),
+                "owner": row.get("owner"),
+            } for row in reader if row.get("name"))
+            imported = await run_in_threadpool(insert_in_batches, "deals", deals)
+            return {"message": "Deals imported successfully", "imported": imported}
         elif ext == "json":
-            content = content.decode("utf-8")
-            deals = json.loads(content)
-            deals = [d for d in deals if d.get('name')]
-            db.table("deals").insert(deals).execute()
-            return {"message": "Deals imported successfully"}
+            deals = (d for d in ijson.items(file.file, "item", use_float=True) if d.get('name'))
+            imported = await run_in_threadpool(insert_in_batches, "deals", deals)
+            return {"message": "Deals imported successfully", "imported": imported}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail="Error processing file")
     
 @app.get("/export/notes")
-def export_notes(format: str = "json"):
-    notes = (db.table("notes").select("*").execute()).data
-    if not notes:
-        return {"error": "No notes found"}
+def export_notes(format: str = "json", pretty: bool = False):
     if format == "csv":
-        output = io.StringIO()
-        writer = DictWriter(output, fieldnames=notes[0].keys())
-        writer.writeheader()
-        writer.writerows(notes)
-        return Response(content=output.getvalue(), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=notes.csv"})
-    else:
-        return Response(content=json.dumps(notes, indent=2), media_type="application/json", headers={"Content-Disposition": "attachment; filename=notes.json"})
+        return StreamingResponse(stream_table_csv("notes", NOTE_COLUMNS), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=notes.csv"})
+    notes = peek_rows(iter_table("notes"))
+    if notes is None:
+        return {"error": "No notes found"}
+    return StreamingResponse(stream_json_array(notes, pretty), media_type="application/json", headers={"Content-Disposition": "attachment; filename=notes.json"})
     
 @app.get("/export/all")
-def export_all(format: str = "json"):
-    customers = (db.table("customers").select("*").execute()).data
-    deals = (db.table("deals").select("*").execute()).data
-    notes = (db.table("notes").select("*").execute()).data
+async def export_all(format: str = "json", pretty: bool = False):
+    if format == "csv":
+        output = stream_csv_zip({
+            "customers": CUSTOMER_COLUMNS,
+            "deals": DEAL_COLUMNS,
+            "notes": NOTE_COLUMNS
+        })
+        return StreamingResponse(output, media_type="application/zip", headers={"Content-Disposition": "attachment; filename=all.zip"})
 
-    if not (customers or deals or notes):
-        return {"error": "No data found"}
+    customers, deals, notes = await asyncio.gather(
+        run_in_threadpool(peek_rows, iter_table("customers")),
+        run_in_threadpool(peek_rows, iter_table("deals")),
+        run_in_threadpool(peek_rows, iter_table("notes"))
+    )
 
-    output = io.StringIO()
-    if format == "csv":
-        writer = DictWriter(output, fieldnames=customers[0].keys())
-        writer.writeheader()
-        writer.writerows(customers)
-        writer = DictWriter(output, fieldnames=deals[0].keys())
-        writer.writeheader()
-        writer.writerows(deals)
-        writer = DictWriter(output, fieldnames=notes[0].keys())
-        writer.writeheader()
-        writer.writerows(notes)
-        return Response(content=output.getvalue(), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=all.csv"})
-    else:
-        all_data = {
-            "customers": customers,
-            "deals": deals,
-            "notes": notes
-        }
-        return Response(content=json.dumps(all_data, indent=2), media_type="application/json", headers={"Content-Disposition": "attachment; filename=all.json"})
+    if customers is None and deals is None and notes is None:
+        return {"error": "No data found"}
+    all_data = {
+        "customers": customers or [],
+        "deals": deals or [],
+        "notes": notes or []
+    }
+    return StreamingResponse(stream_json_object(all_data, pretty), media_type="application/json", headers={"Content-Disposition": "attachment; filename=all.json"})
 
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "healthy"}
 
 @app.get("/")
-def root():
+async def root():
     return {"message": "Welcome to the CRM API"}
 
 @app.get("/users")
 def get_users():
-    users = (db.table("users").select("*").execute()).data
-    return {"users": users}
+    users = (db.table("users").select(USER_FIELDS).execute()).data
+    return ORJSONResponse({"users": users})
 
 @app.post("/users")
-def create_user(user: User):
-    db.table("users").insert(user.dict()).execute()
+def create_user(user: UserCreate):
+    hashed, salt = custom_hash_password(user.password)
+    db.table("users").insert({
+        "name": user.name,
+        "email": user.email,
+        "password_hash": hashed,
+        "password_salt": salt,
+        "role": user.role
+    }).execute()
     return {"message": "User created successfully"}
 
 @app.put("/users/{user_id}")
 def update_user(user_id: str, user: User):
-    db.table("users").update(user.dict()).where("id", user_id).execute()
+    db.table("users").update(user.model_dump(exclude_unset=True, exclude={"id"})).eq("id", user_id).execute()
+    invalidate_user(user_id)
     return {"message": "User updated successfully"}
 
 @app.delete("/users/{user_id}")
 def delete_user(user_id: str):
-    db.table("users").delete().where("id", user_id).execute()
+    db.table("users").delete().eq("id", user_id).execute()
+    invalidate_user(user_id)
     return {"message": "User deleted successfully"}
 
 @app.get("/users/{user_id}")
 def get_user(user_id: str):
-    user = (db.table("users").select("*").where("id", user_id).execute()).data
+    user = (db.table("users").select(USER_FIELDS).eq("id", user_id).execute()).data
     if not user:
         return {"error": "User not found"}
     return {"user": user}
 
 @app.put("/customers/{id}/assign")
 def assign_customer(id: str, assignment: Assignment):
-    user = db.table("users").select("*").eq("id", assignment.assigned_to).execute()
-    if not user.data:
-        raise HTTPException(status_code=400, detail="User not found")
-    
-    customer = db.table("customers").select("*").eq("id", id).execute()
-    if not customer.data:
+    try:
+        resp = db.table("customers").update({"assigned_to": assignment.assigned_to}).eq("id", id).select("id, users!customers_assigned_to_fkey(name)").execute()
+    except APIError as e:
+        handle_fk_violation(e)
+    if not resp.data:
         raise HTTPException(status_code=404, detail="Customer not found")
-    
-    resp = db.table("customers").update({"assigned_to": assignment.assigned_to}).eq("id", id).execute()
     return {
         "success": True,
-        "message": f"Customer assigned to {user.data[0]['name']}",
+        "message": f"Customer assigned to {resp.data[0]['users']['name']}",
         "customer_id": id,
         "assigned_to": assignment.assigned_to
     }
 
 @app.put("/deals/{deal_id}/assign")
 def assign_deal(deal_id: str, assignment: Assignment):
-    user = db.table("users").select("*").eq("id", assignment.assigned_to).execute()
-    if not user.data:
-        raise HTTPException(status_code=400, detail="User not found")
-    deal = db.table("deals").select("*").eq("id", deal_id).execute()
-    if not deal.data:
+    try:
+        resp = db.table("deals").update({"assigned_to": assignment.assigned_to}).eq("id", deal_id).select("id, users!deals_assigned_to_fkey(name)").execute()
+    except APIError as e:
+        handle_fk_violation(e)
+    if not resp.data:
         raise HTTPException(status_code=404, detail="Deal not found")
-    resp = db.table("deals").update({"assigned_to": assignment.assigned_to}).eq("id", deal_id).execute()
     return {
         "success": True,
-        "message": f"Deal assigned to {user.data[0]['name']}",
+        "message": f"Deal assigned to {resp.data[0]['users']['name']}",
         "deal_id": deal_id,
         "assigned_to": assignment.assigned_to
     }
 
 @app.get("/users/{user_id}/dashboard")
-def get_user_dashboard(user_id: str):
-    user = db.table("users").select("*").eq("id", user_id).execute()
+async def get_user_dashboard(user_id: str):
+    user, acustomers, adeals, stats = await asyncio.gather(
+        run_in_threadpool(db.table("users").select(USER_FIELDS).eq("id", user_id).execute),
+        run_in_threadpool(db.table("customers").select("*", count="exact").eq("assigned_to", user_id).limit(5).execute),
+        run_in_threadpool(db.table("deals").select("*").eq("assigned_to", user_id).limit(5).execute),
+        run_in_threadpool(db.rpc("user_deal_stats", {"p_user": user_id}).execute)
+    )
     if not user.data:
         raise HTTPException(status_code=404, detail="User not found")
-    acustomers = db.table("customers").select("*").eq("assigned_to", user_id).execute().data
-    adeals = db.table("deals").select("*").eq("assigned_to", user_id).execute().data
-    active_deals = [d for d in adeals if d.get('status') in ['open', 'in_progress']]
-    wdeals = [d for d in adeals if d.get('status') == 'win']
-    total_revenue = sum(d.get('amt', 0) for d in wdeals)
-    potential_revenue = sum(d.get('amt', 0) for d in active_deals)
-    return {
+    stats = stats.data[0]
+    return ORJSONResponse({
         "user": user.data[0],
-        "assigned_customers": len(acustomers),
-        "assigned_deals": len(adeals),
-        "active_deals": len(active_deals),
-        "won_deals": len(wdeals),
-        "total_revenue": total_revenue,
-        "potential_revenue": potential_revenue,
-        "customers": acustomers[:5],
-        "deals": adeals[:5]
-    }
+        "assigned_customers": acustomers.count,
+        "assigned_deals": stats["total_deals"],
+        "active_deals": stats["active_deals"],
+        "won_deals": stats["won_deals"],
+        "total_revenue": stats["total_revenue"],
+        "potential_revenue": stats["potential_revenue"],
+        "customers": acustomers.data,
+        "deals": adeals.data
+    })
 
 @app.get("/users/{user_id}/customers")
 def get_user_customers(user_id: str):
     customers = db.table("customers").select("*").eq("assigned_to", user_id).execute().data
-    return {"customers": customers}
+    return ORJSONResponse({"customers": customers})
 
 @app.get("/users/{user_id}/deals")
 def get_user_deals(user_id: str):
     deals = db.table("deals").select("*").eq("assigned_to", user_id).execute().data
-    return {"deals": deals}
+    return ORJSONResponse({"deals": deals})
 
 @app.get("/analytics/team-performance")
 def get_team_performance():
-    users = db.table("users").select("*").execute().data
-    deals = db.table("deals").select("*").execute().data
-    team_stats = []
-    for user in users:
-        udeals = [d for d in deals if d.get('assigned_to') == user['id']]
-        wdeals = [d for d in udeals if d.get('stage') == 'won']
-        adeals = [d for d in udeals if d.get('stage') in ['open', 'in_progress']]
-        revenue = sum(d.get('amt', 0) for d in wdeals)
-        potential = sum(d.get('amt', 0) for d in adeals)
-        team_stats.append({
-            "user_id": user['id'],
-            "user_name": user.get('name'),
-            "email": user.get('email'),
-            "role": user.get('role'),
-            "total_deals": len(udeals),
-            "won_deals": len(wdeals),
-            "active_deals": len(adeals),
-            "revenue": revenue,
-            "potential_revenue": potential,
-            "win_rate": round((len(wdeals) / len(udeals) * 100), 2) if udeals else 0
-        })
-    team_stats.sort(key=lambda x: x['revenue'], reverse=True)
-    return {
+    team_stats = db.rpc("team_performance").execute().data
+    return ORJSONResponse({
         "team_performance": team_stats,
         "total_team_revenue": sum(s['revenue'] for s in team_stats),
         "total_team_potential": sum(s['potential_revenue'] for s in team_stats)
-    }
+    })
 
 @app.post("/auth/register", response_model=Token)
 def register(user_data: UserCreate, request: Request):
-    client_info = get_client_info(request)
+    ip, agent = get_client_info(request)
     
-    exist = db.table("users").select("*").eq("email", user_data.email).execute()
+    exist = db.table("users").select("id").eq("email", user_data.email).execute()
     if exist.data:
         log_audit_event(
             action="REGISTER_FAILED",
             type="user",
             details={"reason": "Email already registered", "email": user_data.email},
-            **client_info
+            ip=ip,
+            agent=agent
         )
         raise HTTPException(
             status_code=400,
@@ -834,8 +1119,7 @@ def register(user_data: UserCreate, request: Request):
         "email": user_data.email,
         "password_hash": hashed,
         "password_salt": salt,
-        "role": user_data.role,
-        "created_at": datetime.utcnow().isoformat()
+        "role": user_data.role
     }
     result = db.table("users").insert(user_dict).execute()
     if not result.data:
@@ -844,10 +1128,7 @@ def register(user_data: UserCreate, request: Request):
             detail="Failed to create user"
         )
     user_id = result.data[0]["id"]
-    token_expiry = timedelta(seconds=JWT_EXPIRE)
-    token = create_jwt_token(
-        data={"sub": user_id}, expires_delta=token_expiry
-    )
+    token = create_jwt_token(data={"sub": user_id})
     
     log_audit_event(
         user_id=user_id,
@@ -855,7 +1136,8 @@ def register(user_data: UserCreate, request: Request):
         type="user",
         resource_id=user_id,
         details={"email": user_data.email, "role": user_data.role},
-        **client_info
+        ip=ip,
+        agent=agent
     )
 
     return {"access_token": token, "token_type": "bearer"}
@@ -864,12 +1146,12 @@ def register(user_data: UserCreate, request: Request):
 def login(user_credentials: UserLogin, request: Request):
     ip, agent = get_client_info(request)
     
-    user = db.table("users").select("*").eq("email", user_credentials.email).execute()
+    user = db.table("users").select("id, password_hash, password_salt").eq("email", user_credentials.email).execute()
     if not user.data:
         log_audit_event(
             action="LOGIN_FAILED",
             type="user",
-            details=json.dumps({"reason": "User not found", "email": user_credentials.email}),
+            details={"reason": "User not found", "email": user_credentials.email},
             ip=ip,
             agent=agent
         )
@@ -884,7 +1166,7 @@ def login(user_credentials: UserLogin, request: Request):
             user_id=user_data["id"],
             action="LOGIN_FAILED",
             type="user",
-            details=json.dumps({"reason": "Invalid password", "email": user_credentials.email}),
+            details={"reason": "Invalid password", "email": user_credentials.email},
             ip=ip,
             agent=agent
         )
@@ -893,16 +1175,20 @@ def login(user_credentials: UserLogin, request: Request):
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    token_expiry = timedelta(seconds=JWT_EXPIRE)
-    token = create_jwt_token(
-        data={"sub": user_data["id"]}, expires_delta=token_expiry
-    )
+    if needs_rehash(user_data["password_hash"]):
+        hashed, salt = custom_hash_password(user_credentials.password)
+        db.table("users").update({
+            "password_hash": hashed,
+            "password_salt": salt
+        }).eq("id", user_data["id"]).execute()
+        invalidate_user(user_data["id"])
+    token = create_jwt_token(data={"sub": user_data["id"]})
     
     log_audit_event(
         user_id=user_data["id"],
         action="LOGIN",
         type="user",
-        details=json.dumps({"email": user_credentials.email}),
+        details={"email": user_credentials.email},
         ip=ip,
         agent=agent
     )
@@ -910,16 +1196,13 @@ def login(user_credentials: UserLogin, request: Request):
     return {"access_token": token, "token_type": "bearer"}
 
 @app.post("/auth/refresh", response_model=Token)
-def refresh_token(current_user: dict = Depends(get_current_user)):
-    token_expiry = timedelta(seconds=JWT_EXPIRE)
-    token = create_jwt_token(
-        data={"sub": current_user["id"]}, expires_delta=token_expiry
-    )
+async def refresh_token(current_user: dict = Depends(get_current_user)):
+    token = create_jwt_token(data={"sub": current_user["id"]})
 
     return {"access_token": token, "token_type": "bearer"}
 
 @app.get("/auth/me")
-def get_current_user_info(current_user: dict = Depends(get_current_user)):
+async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     user_info = {
         "id": current_user["id"],
         "name": current_user["name"],
@@ -930,7 +1213,8 @@ def get_current_user_info(current_user: dict = Depends(get_current_user)):
 
 @app.post("/auth/change-password")
 def change_password(password_data: PasswordChange, current_user: dict = Depends(get_current_user)):
-    if not verify(password_data.current_password, current_user["password_hash"], current_user["password_salt"]):
+    secret = get_user_secret(current_user["id"])
+    if not verify(password_data.current_password, secret["password_hash"], secret["password_salt"]):
         raise HTTPException(
             status_code=400,
             detail="Current password is incorrect"
@@ -945,6 +1229,7 @@ def change_password(password_data: PasswordChange, current_user: dict = Depends(
             status_code=500,
             detail="Failed to update password"
         )
+    invalidate_user(current_user["id"])
 
     return {"message": "Password changed successfully"}
 
@@ -963,7 +1248,7 @@ def get_audit_logs(
     if current_user["role"] not in ["admin", "manager"]:
         raise HTTPException(status_code=403, detail="Not authorized to view audit logs")
     
-    client_info = get_client_info(request)
+    ip, agent = get_client_info(request)
     
     query = db.table("audit_logs").select("*, users!audit_logs_user_id_fkey(name, email)")
     
@@ -995,17 +1280,18 @@ def get_audit_logs(
             "pagination": {"limit": limit, "offset": offset},
             "count": len(result.data)
         },
-        **client_info
+        ip=ip,
+        agent=agent
     )
     
-    return {
+    return ORJSONResponse({
         "audit_logs": result.data,
         "pagination": {
             "limit": limit,
             "offset": offset,
             "count": len(result.data)
         }
-    }
+    })
 
 @app.get("/audit-logs/user/{user_id}")
 def get_user_audit_logs(
@@ -1017,7 +1303,7 @@ def get_user_audit_logs(
     if current_user["id"] != user_id and current_user["role"] not in ["admin", "manager"]:
         raise HTTPException(status_code=403, detail="Not authorized to view these audit logs")
     
-    client_info = get_client_info(request)
+    ip, agent = get_client_info(request)
     
     result = db.table("audit_logs").select("*").eq("user_id", user_id).order("timestamp", desc=True).limit(limit).execute()
     
@@ -1026,14 +1312,15 @@ def get_user_audit_logs(
         action="VIEW_USER_AUDIT_LOGS",
         type="audit_log",
         details={"target_user_id": user_id, "count": len(result.data)},
-        **client_info
+        ip=ip,
+        agent=agent
     )
     
-    return {
+    return ORJSONResponse({
         "user_id": user_id,
         "audit_logs": result.data,
         "count": len(result.data)
-    }
+    })
 
 @app.get("/audit-logs/resource/{type}/{resource_id}")
 def get_resource_audit_logs(
@@ -1045,7 +1332,7 @@ def get_resource_audit_logs(
     if current_user["role"] not in ["admin", "manager"]:
         raise HTTPException(status_code=403, detail="Not authorized to view resource audit logs")
     
-    client_info = get_client_info(request)
+    ip, agent = get_client_info(request)
     
     result = db.table("audit_logs").select("*, users!audit_logs_user_id_fkey(name, email)").eq("type", type).eq("resource_id", resource_id).order("timestamp", desc=True).execute()
     
@@ -1058,96 +1345,66 @@ def get_resource_audit_logs(
             "target_resource_id": resource_id,
             "count": len(result.data)
         },
-        **client_info
+        ip=ip,
+        agent=agent
     )
     
-    return {
+    return ORJSONResponse({
         "type": type,
         "resource_id": resource_id,
         "audit_logs": result.data,
         "count": len(result.data)
-    }
+    })
 
 @app.post("/generate-email")
-def gen_email(request: dict, current_user: dict = Depends(get_current_user)):
+async def gen_email(request: dict, current_user: dict = Depends(get_current_user)):
     customer_id = request.get("customer_id")
     type = request.get("type")
-    customer = db.table("customers").select("*").eq("id", customer_id).execute()
-    deals = db.table("deals").select("*").eq("customer_id", customer_id).execute()
-    r = requests.post("https://ai.hackclub.com/chat/completions", headers={
-        "Content-Type": "application/json"
-    }, json={
-        "model": "openai/gpt-oss-120b",
-        "messages": [
-            {"role": "user", "content": f"""
-                Write a professional {type} email for:
-                Customer: {customer['name']} at {customer.get('company')}
-                Email: {customer.get('email')}
-                Active Deals: {len(deals)} worth ${sum(d.get('amt', 0) for d in deals)}
-
-                Make it:
-                - Professional but friendly
-                - Personalized
-                - Under 150 words
-
-                Include subject line."""}
-        ]
-    })
-    return {"email": r.json()['choices'][0]['message']['content']}
-
-@app.post("handle-objection")
-def handle_objection(request: dict, current_user: dict = Depends(get_current_user)):
+    customer, deals = await asyncio.gather(
+        run_in_threadpool(db.table("customers").select("name, company, email").eq("id", customer_id).execute),
+        run_in_threadpool(db.table("deals").select("amt").eq("customer_id", customer_id).execute)
+    )
+    if not customer.data:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    customer = customer.data[0]
+    deals = deals.data
+    email = await ask_ai(GEN_EMAIL_PROMPT.format_map({
+        "type": type,
+        "name": customer['name'],
+        "company": customer.get('company'),
+        "email": customer.get('email'),
+        "deals_count": len(deals),
+        "deals_value": sum(d.get('amt', 0) for d in deals)
+    }))
+    return {"email": email}
+
+@app.post("/handle-objection")
+async def handle_objection(request: dict, current_user: dict = Depends(get_current_user)):
     """Get AI help for handling customer objections"""
     objection = request.get("objection")
     context = request.get("context", "")
     
-    r = requests.post("https://ai.hackclub.com/chat/completions", headers={
-        "Content-Type": "application/json"
-    }, json={
-        "model": "openai/gpt-oss-120b",
-        "messages": [{
-            "role": "user",
-            "content": f"""
-            help handle this sales objection:
-            objection: "{objection}"
-            context: {context}
-
-            provide:
-            1. 3 different response approaches
-            2. questions to ask back
-            3. evidence/proof points to use
-            4. how to redirect conversation
-            5. when to concede vs push back
-            be practical and conversational."""
-                    }]
-    })
+    response = await ask_ai(OBJECTION_PROMPT.format_map({"objection": objection, "context": context}))
     
-    return {"response": r.json()['choices'][0]['message']['content']}
+    return {"response": response}
 
 @app.post("/meeting-prep")
-def meeting_prep(customer_id: str, current_user: dict = Depends(get_current_user)):
-    customer = db.table("customers").select("*").eq("id", customer_id).execute().data[0]
-    deals = db.table("deals").select("*").eq("customer_id", customer_id).execute().data
-    notes = db.table("notes").select("*").eq("customer_id", customer_id).execute().data[-5:]
-    r = requests.post("https://ai.hackclub.com/chat/completions", headers={
-        "Content-Type": "application/json"
-    }, json={
-        "model": "openai/gpt-oss-120b",
-        "messages": [
-            {"role": "user", "content": f"""
-                Create a meeting prep brief for:
-                Customer: {customer['name']} ({customer.get('company')})
-                Active Deals: {len(deals)} worth ${sum(d.get('amt', 0) for d in deals)}
-                Recent History: {len(notes)} recent interactions
-
-                Provide:
-                1. Key talking points
-                2. Questions to ask
-                3. Potential objections & responses
-                4. Goals for this meeting
-                5. Follow-up actions
-
-                Keep it concise and actionable."""}
-        ]
-    })
-    return {"prep": r.json()['choices'][0]['message']['content']}
+async def meeting_prep(customer_id: str, current_user: dict = Depends(get_current_user)):
+    customer, deals, notes = await asyncio.gather(
+        run_in_threadpool(db.table("customers").select("name, company").eq("id", customer_id).execute),
+        run_in_threadpool(db.table("deals").select("amt").eq("customer_id", customer_id).execute),
+        run_in_threadpool(db.table("notes").select("id").eq("customer_id", customer_id).limit(5).execute)
+    )
+    if not customer.data:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    customer = customer.data[0]
+    deals = deals.data
+    notes = notes.data
+    prep = await ask_ai(MEETING_PREP_PROMPT.format_map({
+        "name": customer['name'],
+        "company": customer.get('company'),
+        "deals_count": len(deals),
+        "deals_value": sum(d.get('amt', 0) for d in deals),
+        "notes_count": len(notes)
+    }))
+    return {"prep": prep}